@@ -12,8 +12,21 @@ def _():
     import gspread
     from gspread_dataframe import set_with_dataframe
     import json
+    import sys
+    sys.path.append("src")
+    from sheet_cache import SheetSnapshotCache
+    import pipeline
     logging.basicConfig(level=logging.INFO)
-    return gspread, json, logging, pd, service_account, set_with_dataframe
+    return (
+        SheetSnapshotCache,
+        gspread,
+        json,
+        logging,
+        pd,
+        pipeline,
+        service_account,
+        set_with_dataframe,
+    )
 
 
 @app.cell
@@ -54,22 +67,28 @@ def _(json, pd):
 
 
 @app.cell
-def _(df_ir_user_name, pd, worksheet):
-    # googleスプレッドシートの読み込み
-    values = worksheet.get_values()
-    if not values:
-        df = pd.DataFrame()
-    else:
-        header = values[0]
-        data = values[1:]
-        df = pd.DataFrame(data, columns=header)
+def _(SheetSnapshotCache, df_ir_user_name, logging, pd, worksheet):
+    # googleスプレッドシートの読み込み（変更があった時だけ取得、追記分のみ差分取得）
+    # best_score / score は int 変換済みのスナップショットを返す
+    sheet_cache = SheetSnapshotCache(worksheet)
+    df = sheet_cache.get_dataframe()
+    logging.info("Sheet fetch: %s", sheet_cache.last_fetch)
     df = pd.merge(df, df_ir_user_name, how="left")
-    df["best_score"] = pd.to_numeric(df.get("best_score", None), errors="coerce").fillna(0).astype(int)
-    df["score"] = pd.to_numeric(df.get("score", None), errors="coerce").fillna(0).astype(int)
     df.fillna("", inplace=True)
     return (df,)
 
 
+@app.cell
+def _(df, pipeline):
+    # ファイルを経由せずにランキングとGrandMasterを計算
+    records = df.to_dict("records")
+    rankings_by_song, histories_by_song = pipeline.rankings(records)
+    gm_table, gm_history = pipeline.grandmaster(records, "input/song_list.json")
+    df_gm = gm_table.to_dataframe()
+    df_gm
+    return df_gm, gm_history, gm_table, histories_by_song, rankings_by_song
+
+
 @app.cell
 def _(df):
     # 脳筋IR結果シート更新用に、時間順にデータ抽出
@@ -0,0 +1,92 @@
+import gzip
+import io
+import os
+
+# zstd support is optional: pip install zstandard
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# Output compression for every writer: "" (plain CSV), "gz" or "zst".
+# Levels are low on purpose: at these settings compression runs faster than
+# csv parsing/formatting, so runs stay CPU-bound on the CSV work, not on disk.
+COMPRESSION = os.environ.get("NOUSUJI_COMPRESSION", "").strip().lower()
+GZIP_LEVEL = 1
+ZSTD_LEVEL = 3
+
+SUFFIXES = {"gz": ".gz", "zst": ".zst"}
+GZIP_MAGIC = b"\x1f\x8b"
+ZSTD_MAGIC = b"\x28\xb5\x2f\xfd"
+
+
+def compressed_path(path, compression=None):
+    """Append the suffix for `compression` (default: COMPRESSION) to path."""
+    compression = COMPRESSION if compression is None else compression
+    if not compression:
+        return path
+    if compression not in SUFFIXES:
+        raise ValueError(f"Unknown compression: {compression}")
+    suffix = SUFFIXES[compression]
+    return path if path.endswith(suffix) else path + suffix
+
+
+def resolve_input(path):
+    """Return path, or its .gz/.zst sibling when only the compressed file exists."""
+    if os.path.exists(path):
+        return path
+    for suffix in SUFFIXES.values():
+        if os.path.exists(path + suffix):
+            return path + suffix
+    return path
+
+
+def detect_compression(path):
+    """Sniff the file's magic bytes: "gz", "zst" or ""."""
+    with open(path, "rb") as f:
+        head = f.read(4)
+    if head.startswith(GZIP_MAGIC):
+        return "gz"
+    if head == ZSTD_MAGIC:
+        return "zst"
+    return ""
+
+
+def _require_zstandard():
+    if zstandard is None:
+        raise ImportError("zstd compression requires the 'zstandard' package")
+
+
+def open_text(path, mode="r", newline=None):
+    """Open a (possibly compressed) UTF-8 text file for streaming.
+
+    Reading detects gzip/zstd from the file contents; writing picks the
+    format from the path suffix (.gz / .zst) and compresses on the fly.
+    """
+    if "r" in mode:
+        compression = detect_compression(path)
+    elif path.endswith(SUFFIXES["gz"]):
+        compression = "gz"
+    elif path.endswith(SUFFIXES["zst"]):
+        compression = "zst"
+    else:
+        compression = ""
+
+    if compression == "gz":
+        return gzip.open(
+            path,
+            "rt" if "r" in mode else "wt",
+            compresslevel=GZIP_LEVEL,
+            encoding="utf-8",
+            newline=newline,
+        )
+    if compression == "zst":
+        _require_zstandard()
+        if "r" in mode:
+            raw = zstandard.ZstdDecompressor().stream_reader(open(path, "rb"))
+        else:
+            raw = zstandard.ZstdCompressor(level=ZSTD_LEVEL).stream_writer(
+                open(path, "wb")
+            )
+        return io.TextIOWrapper(raw, encoding="utf-8", newline=newline)
+    return open(path, mode, encoding="utf-8", newline=newline)
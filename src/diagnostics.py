@@ -0,0 +1,109 @@
+import collections
+import json
+import logging
+
+# Reasons recorded when a Left/Right token is sanitized
+REASON_FLAG = "flag_in_left_right"  # FLIP / LEGACY / A-SCR / OFF read as L/R
+REASON_UNKNOWN = "unknown_token"
+
+FLAG_TOKENS = {"FLIP", "LEGACY", "A-SCR", "OFF"}
+
+# Keys listed in the log summary; the JSON report has the full breakdown
+SUMMARY_TOP_N = 10
+
+logger = logging.getLogger(__name__)
+
+
+class SanitizeDiagnostics:
+    """Counts token sanitizations per (raw token, reason).
+
+    record() only bumps a counter and, for the first `sample_limit`
+    occurrences of a key, keeps a (row index, row) reference; nothing is
+    formatted until report() / log_summary(). verbose=True additionally logs
+    every occurrence, like the old per-row warning.
+    """
+
+    def __init__(self, sample_limit=5, verbose=False):
+        self.sample_limit = sample_limit
+        self.verbose = verbose
+        self.counts = collections.Counter()
+        self.samples = collections.defaultdict(list)
+
+    def __len__(self):
+        return sum(self.counts.values())
+
+    def record(self, token, reason, row_idx=None, row=None):
+        key = (token, reason)
+        self.counts[key] += 1
+        samples = self.samples[key]
+        if len(samples) < self.sample_limit:
+            samples.append((row_idx, row))
+        if self.verbose:
+            logger.warning(
+                "Invalid Left/Right token '%s' (%s) at row %s (UserName=%s,TwitterID=%s); sanitizing to empty",
+                token,
+                reason,
+                row_idx if row_idx is not None else "?",
+                row.get("UserName", "") if isinstance(row, dict) else "",
+                row.get("TwitterID", "") if isinstance(row, dict) else "",
+            )
+
+    def merge(self, other, row_offset=0):
+        """Add another instance's counts and samples (e.g. from a worker).
+
+        Sample row indices are shifted by `row_offset`; samples beyond
+        `sample_limit` are dropped.
+        """
+        for key, count in other.counts.items():
+            self.counts[key] += count
+            samples = self.samples[key]
+            for row_idx, row in other.samples.get(key, []):
+                if len(samples) >= self.sample_limit:
+                    break
+                if row_idx is not None:
+                    row_idx += row_offset
+                samples.append((row_idx, row))
+
+    def report(self):
+        """Summary as a JSON-serializable dict, most frequent tokens first."""
+        entries = []
+        for (token, reason), count in self.counts.most_common():
+            examples = []
+            for row_idx, row in self.samples[(token, reason)]:
+                row = row if isinstance(row, dict) else {}
+                examples.append(
+                    {
+                        "row": row_idx,
+                        "UserName": row.get("UserName", ""),
+                        "TwitterID": row.get("TwitterID", ""),
+                        "options": row.get("options", ""),
+                    }
+                )
+            entries.append(
+                {"token": token, "reason": reason, "count": count, "examples": examples}
+            )
+        return {"total": len(self), "entries": entries}
+
+    def to_json(self, indent=2):
+        return json.dumps(self.report(), ensure_ascii=False, indent=indent)
+
+    def write_json(self, path):
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(self.to_json())
+
+    def log_summary(self, top_n=SUMMARY_TOP_N):
+        """Emit one warning with the `top_n` most frequent keys (nothing if none)."""
+        if not self.counts:
+            return
+        ranked = self.counts.most_common()
+        parts = [
+            f"'{token}' ({reason}) x{count}"
+            for (token, reason), count in ranked[:top_n]
+        ]
+        if len(ranked) > top_n:
+            parts.append(f"… and {len(ranked) - top_n} more")
+        logger.warning(
+            "Sanitized %d invalid Left/Right tokens to empty: %s",
+            len(self),
+            ", ".join(parts),
+        )
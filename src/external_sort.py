@@ -0,0 +1,145 @@
+import heapq
+import os
+import pickle
+import shutil
+import sys
+import tempfile
+
+# Memory budget (MB) for history sorting. Unset/empty keeps the in-memory
+# sort; a value switches writers to spilling sorted runs to temp files.
+SORT_MEMORY_MB = os.environ.get("NOUSUJI_SORT_MEMORY_MB", "").strip()
+# Maximum number of run files opened at once while merging
+MAX_MERGE_FANIN = 64
+
+
+def default_budget():
+    """SpillBudget from NOUSUJI_SORT_MEMORY_MB, or None for in-memory sorting."""
+    if not SORT_MEMORY_MB:
+        return None
+    return SpillBudget(int(float(SORT_MEMORY_MB) * 1024 * 1024))
+
+
+def row_size(row):
+    """Rough in-memory size of a row (dict, list or tuple) in bytes.
+
+    Nested dicts, lists and tuples (e.g. (key, seq, rec) items) are counted
+    too.
+    """
+    values = row.values() if isinstance(row, dict) else row
+    return sys.getsizeof(row) + sum(
+        row_size(v) if isinstance(v, (dict, list, tuple)) else sys.getsizeof(v)
+        for v in values
+    )
+
+
+class SpillBudget:
+    """Memory budget shared by several sorters (e.g. one per song).
+
+    When the buffered rows of all sorters exceed the limit, the largest
+    buffers are spilled to disk until usage is back under the limit.
+    """
+
+    def __init__(self, limit_bytes):
+        self.limit = max(1, limit_bytes)
+        self.used = 0
+        self.sorters = []
+
+    def charge(self, nbytes):
+        self.used += nbytes
+        while self.used > self.limit:
+            largest = max(self.sorters, key=lambda s: s.buffered_bytes)
+            if not largest.buffer:
+                break
+            largest.spill()
+
+
+class ExternalSorter:
+    """Stable sort of an unbounded row stream under a memory budget.
+
+    Rows are buffered; when the budget is exceeded the buffer is sorted and
+    pickled to a temporary run file. Iterating merges the runs with
+    heapq.merge. Runs are written in arrival order and heapq.merge prefers
+    earlier runs on ties, so the result equals sorted(rows, key=key).
+    Without a budget everything stays in memory.
+    """
+
+    def __init__(self, key, memory_budget=None, tmp_dir=None):
+        self.key = key
+        if isinstance(memory_budget, int):
+            memory_budget = SpillBudget(memory_budget)
+        self.budget = memory_budget
+        if self.budget is not None:
+            self.budget.sorters.append(self)
+        self.tmp_dir = tmp_dir
+        self.buffer = []
+        self.buffered_bytes = 0
+        self.run_dir = None
+        self.runs = []
+        self.count = 0
+
+    def __len__(self):
+        return self.count
+
+    def append(self, row):
+        self.buffer.append(row)
+        self.count += 1
+        if self.budget is not None:
+            nbytes = row_size(row)
+            self.buffered_bytes += nbytes
+            self.budget.charge(nbytes)
+
+    def spill(self):
+        if not self.buffer:
+            return
+        self.buffer.sort(key=self.key)
+        self.runs.append(self._write_run(self.buffer))
+        self.buffer = []
+        if self.budget is not None:
+            self.budget.used -= self.buffered_bytes
+        self.buffered_bytes = 0
+
+    def _write_run(self, rows):
+        if self.run_dir is None:
+            self.run_dir = tempfile.mkdtemp(prefix="nousuji_sort_", dir=self.tmp_dir)
+        fd, path = tempfile.mkstemp(suffix=".pkl", dir=self.run_dir)
+        with os.fdopen(fd, "wb") as f:
+            for row in rows:
+                pickle.dump(row, f, protocol=pickle.HIGHEST_PROTOCOL)
+        return path
+
+    def _merge_runs(self, paths):
+        return heapq.merge(*(self._read_run(p) for p in paths), key=self.key)
+
+    def _read_run(self, path):
+        with open(path, "rb") as f:
+            while True:
+                try:
+                    yield pickle.load(f)
+                except EOFError:
+                    return
+
+    def __iter__(self):
+        if not self.runs:
+            return iter(sorted(self.buffer, key=self.key))
+        self.spill()
+        # Merge consecutive runs first when there are too many to open at
+        # once; keeping them adjacent preserves the stable tie order.
+        while len(self.runs) > MAX_MERGE_FANIN:
+            head = self.runs[:MAX_MERGE_FANIN]
+            merged = self._write_run(self._merge_runs(head))
+            for p in head:
+                os.remove(p)
+            self.runs = [merged] + self.runs[MAX_MERGE_FANIN:]
+        return self._merge_runs(self.runs)
+
+    def close(self):
+        """Remove spilled run files."""
+        if self.run_dir is not None:
+            shutil.rmtree(self.run_dir, ignore_errors=True)
+            self.run_dir = None
+        self.runs = []
+        self.buffer = []
+        if self.budget is not None and self in self.budget.sorters:
+            self.budget.used -= self.buffered_bytes
+            self.budget.sorters.remove(self)
+        self.buffered_bytes = 0
@@ -0,0 +1,97 @@
+import csv
+import re
+
+from csv_io import open_text
+
+# Offline stand-in for the subset of gspread used by sheet_cache and the
+# notebook: get_values / batch_get / append_rows / update_cell and
+# add_worksheet.
+
+A1_RANGE = re.compile(r"^([A-Z]*)(\d*):([A-Z]*)(\d*)$")
+
+
+def column_index(letters):
+    """A1 column letters -> 1-based index (A -> 1, AA -> 27)."""
+    idx = 0
+    for ch in letters:
+        idx = idx * 26 + (ord(ch) - ord("A") + 1)
+    return idx
+
+
+class FakeSpreadsheet:
+    def __init__(self):
+        self.worksheets = {}
+        self.calls = []  # (method, args) log to check what was fetched
+
+    def worksheet(self, title):
+        return self.worksheets[title]
+
+    def add_worksheet(self, title, rows=0, cols=0):
+        ws = FakeWorksheet(self, title, [])
+        self.worksheets[title] = ws
+        return ws
+
+
+class FakeWorksheet:
+    def __init__(self, spreadsheet, title, values):
+        self.spreadsheet = spreadsheet
+        self.title = title
+        self.values = [list(r) for r in values]
+
+    @classmethod
+    def from_csv(cls, path, title="result_summary_processed", spreadsheet=None):
+        """Build a fake sheet from a local CSV (gzip/zstd read transparently)."""
+        spreadsheet = spreadsheet or FakeSpreadsheet()
+        with open_text(path, "r", newline="") as f:
+            values = list(csv.reader(f))
+        ws = cls(spreadsheet, title, values)
+        spreadsheet.worksheets[title] = ws
+        return ws
+
+    def range_rows(self, range_name):
+        """Rows of an A1 range such as "A2:T", "1:1" or "A1:T10"."""
+        m = A1_RANGE.match(range_name)
+        if not m:
+            raise ValueError(f"Unsupported range: {range_name}")
+        c1, r1, c2, r2 = m.groups()
+        r1 = int(r1) if r1 else 1
+        r2 = int(r2) if r2 else len(self.values)
+        c1 = column_index(c1) if c1 else 1
+        c2 = column_index(c2) if c2 else max(map(len, self.values), default=0)
+        return [list(r[c1 - 1 : c2]) for r in self.values[r1 - 1 : r2]]
+
+    def get_values(self, range_name=None):
+        # Like gspread, an empty sheet or range comes back as [[]], not []
+        self.spreadsheet.calls.append(("get_values", range_name))
+        if range_name is None:
+            return [list(r) for r in self.values] or [[]]
+        return self.range_rows(range_name) or [[]]
+
+    def batch_get(self, ranges):
+        # One request; like gspread, empty ranges are [] and trailing blank
+        # cells are not returned
+        self.spreadsheet.calls.append(("batch_get", tuple(ranges)))
+        result = []
+        for range_name in ranges:
+            rows = self.range_rows(range_name)
+            for r in rows:
+                while r and r[-1] == "":
+                    r.pop()
+            while rows and not rows[-1]:
+                rows.pop()
+            result.append(rows)
+        return result
+
+    def append_rows(self, rows):
+        self.values.extend([str(v) for v in r] for r in rows)
+
+    def append_row(self, row):
+        self.append_rows([row])
+
+    def update_cell(self, row, col, value):
+        while len(self.values) < row:
+            self.values.append([])
+        r = self.values[row - 1]
+        while len(r) < col:
+            r.append("")
+        r[col - 1] = str(value)
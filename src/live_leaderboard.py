@@ -0,0 +1,256 @@
+import bisect
+import sys
+
+from proc_GM_ranking import (
+    INPUT_JSON,
+    load_song_list,
+    parse_row,
+    update_user,
+    user_rates,
+)
+from proc_music_ranking import INPUT_FILE, load_row_sources, update_best_record
+
+# GM totals are ranked at the 4-decimal precision they are published with
+GM_SCALE = 10000
+
+
+class FenwickCounter:
+    """Counts of non-negative integer keys with O(log n) add and prefix sums.
+
+    The key range doubles on demand, so no upper bound is needed up front.
+    """
+
+    def __init__(self, size=1024):
+        self.size = size
+        self.tree = [0] * (size + 1)
+        self.total = 0
+
+    def grow(self, key):
+        counts = [self.count_range(i, i) for i in range(self.size)]
+        while self.size <= key:
+            self.size *= 2
+        self.tree = [0] * (self.size + 1)
+        self.total = 0
+        for i, c in enumerate(counts):
+            if c:
+                self.add(i, c)
+
+    def add(self, key, delta=1):
+        if key >= self.size:
+            self.grow(key)
+        self.total += delta
+        i = key + 1
+        while i <= self.size:
+            self.tree[i] += delta
+            i += i & -i
+
+    def count_le(self, key):
+        """Number of stored keys <= key."""
+        if key < 0:
+            return 0
+        i = min(key, self.size - 1) + 1
+        s = 0
+        while i > 0:
+            s += self.tree[i]
+            i -= i & -i
+        return s
+
+    def count_range(self, lo, hi):
+        return self.count_le(hi) - self.count_le(lo - 1)
+
+
+class Leaderboard:
+    """One ranking board: member -> integer key, higher is better.
+
+    rank = 1 + number of members with a strictly higher key, so tied
+    members share a rank. Updates and rank queries are O(log n); the
+    members at each key are also kept so the ones whose rank changed
+    because another member moved can be listed.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.keys = {}
+        self.counter = FenwickCounter()
+        self.sorted_keys = []  # distinct keys, ascending
+        self.members = {}  # key -> {member: None} in arrival order
+
+    def __len__(self):
+        return len(self.keys)
+
+    def rank(self, member):
+        key = self.keys.get(member)
+        if key is None:
+            return None
+        return 1 + self.counter.total - self.counter.count_le(key)
+
+    def set(self, member, key):
+        """Store member's key; returns (old_rank, new_rank)."""
+        old_rank = self.rank(member)
+        old_key = self.keys.get(member)
+        if old_key == key:
+            return old_rank, old_rank
+        if old_key is not None:
+            self.counter.add(old_key, -1)
+            at_key = self.members[old_key]
+            del at_key[member]
+            if not at_key:
+                del self.members[old_key]
+                del self.sorted_keys[bisect.bisect_left(self.sorted_keys, old_key)]
+        self.keys[member] = key
+        self.counter.add(key, 1)
+        if key not in self.members:
+            self.members[key] = {}
+            bisect.insort(self.sorted_keys, key)
+        self.members[key][member] = None
+        return old_rank, self.rank(member)
+
+    def members_between(self, lo, hi):
+        """Members with lo <= key < hi, highest key first."""
+        i = bisect.bisect_left(self.sorted_keys, lo)
+        j = bisect.bisect_left(self.sorted_keys, hi)
+        for key in reversed(self.sorted_keys[i:j]):
+            yield from self.members[key]
+
+    def displaced(self, member, old_key, new_key):
+        """Other members whose rank changed when member moved old_key -> new_key.
+
+        Yields (member, old_rank, new_rank). Moving up past a key pushes
+        its members down one place; moving down lets them up one place. A
+        new member (old_key None) pushes down everyone below it.
+        """
+        if old_key is None or new_key > old_key:
+            lo, hi, shift = 0 if old_key is None else old_key, new_key, -1
+        else:
+            lo, hi, shift = new_key, old_key, 1
+        for other in self.members_between(lo, hi):
+            if other != member:
+                new_rank = self.rank(other)
+                yield other, new_rank + shift, new_rank
+
+    def standings(self):
+        """(member, key) pairs sorted by key descending."""
+        return sorted(self.keys.items(), key=lambda kv: kv[1], reverse=True)
+
+
+class LiveLeaderboards:
+    """Per-song and GrandMaster boards updated one ingested row at a time.
+
+    Song boards follow update_best_record (best score per TwitterID);
+    the GM board follows parse_row / update_user and ranks the sum of
+    score / (notes * 2) over the selected songs. Manual rows
+    (manual_users.csv) only feed the song boards, as in proc_GM_ranking.
+
+    ingest() returns the rank change events caused by the row: one for the
+    submitting member, then one per member it passed (or fell behind),
+    marked with "by". A new entry near the top of a large board therefore
+    yields one event per member below it.
+    """
+
+    def __init__(self, input_json=INPUT_JSON):
+        self.name_to_no, self.notes_by_no, self.song_nos = load_song_list(input_json)
+        self.songs_data = {}
+        self.gm_users = {}
+        self.song_boards = {}
+        self.gm_board = Leaderboard("GrandMaster")
+
+    def song_board(self, song):
+        if song not in self.song_boards:
+            self.song_boards[song] = Leaderboard(song)
+        return self.song_boards[song]
+
+    def update_board(self, board, twitter_id, key, records, scale=1):
+        """Set twitter_id's key on board and return the resulting events.
+
+        records maps TwitterID -> state with a "UserName"; scale converts
+        keys back to published scores.
+        """
+        old_key = board.keys.get(twitter_id)
+        old_rank, new_rank = board.set(twitter_id, key)
+        events = []
+        if old_rank != new_rank:
+            events.append(
+                {
+                    "board": board.name,
+                    "TwitterID": twitter_id,
+                    "UserName": records[twitter_id]["UserName"],
+                    "old_rank": old_rank,
+                    "new_rank": new_rank,
+                    "old_score": None if old_key is None else old_key / scale,
+                    "new_score": key / scale,
+                }
+            )
+        # Leaving a tie changes the others' rank even when ours stays put
+        for other, other_old, other_new in board.displaced(twitter_id, old_key, key):
+            other_score = board.keys[other] / scale
+            events.append(
+                {
+                    "board": board.name,
+                    "TwitterID": other,
+                    "UserName": records[other]["UserName"],
+                    "old_rank": other_old,
+                    "new_rank": other_new,
+                    "old_score": other_score,
+                    "new_score": other_score,
+                    "by": twitter_id,
+                }
+            )
+        return events
+
+    def ingest(self, row, manual=False):
+        """Apply one result row; manual=True for manual_users.csv rows."""
+        events = []
+        key = update_best_record(self.songs_data, row)
+        if key is not None:
+            song, twitter_id = key
+            records = self.songs_data[song]
+            events += self.update_board(
+                self.song_board(song), twitter_id, records[twitter_id]["score"], records
+            )
+
+        rec = None if manual else parse_row(row, self.name_to_no)
+        if rec is not None:
+            user = update_user(self.gm_users, rec)
+            _, total = user_rates(user, self.song_nos, self.notes_by_no)
+            events += self.update_board(
+                self.gm_board,
+                rec["twitter_id"],
+                round(total * GM_SCALE),
+                self.gm_users,
+                GM_SCALE,
+            )
+        return events
+
+
+def ordinal(n):
+    if 10 <= n % 100 <= 20:
+        suffix = "th"
+    else:
+        suffix = {1: "st", 2: "nd", 3: "rd"}.get(n % 10, "th")
+    return f"{n}{suffix}"
+
+
+def format_event(event):
+    name = event["UserName"] or event["TwitterID"]
+    if event["old_rank"] is None:
+        return f"{name} entered {event['board']} at {ordinal(event['new_rank'])}"
+    text = (
+        f"{name} moved from {ordinal(event['old_rank'])} to "
+        f"{ordinal(event['new_rank'])} on {event['board']}"
+    )
+    if "by" in event:
+        text += f" (after {event['by']})"
+    return text
+
+
+if __name__ == "__main__":
+    # Replay the processed CSV (or given shards) and print rank changes;
+    # manual_users.csv rows follow the shards and skip the GM board
+    boards = LiveLeaderboards()
+    _, shard_rows, manual_rows = load_row_sources(sys.argv[1:] or INPUT_FILE)
+    for row in shard_rows:
+        for ev in boards.ingest(row):
+            print(format_event(ev))
+    for row in manual_rows:
+        for ev in boards.ingest(row, manual=True):
+            print(format_event(ev))
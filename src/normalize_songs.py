@@ -4,6 +4,9 @@ import sys
 import os
 import json
 
+from csv_io import compressed_path, open_text, resolve_input
+from parallel_csv import csv_text, map_csv_chunks
+
 # Files
 INPUT_FILE = "../input/result_summary.csv"
 OUTPUT_FILE = "../output/intermediate_songs.csv"
@@ -65,59 +68,81 @@ def get_best_match(name, candidates):
     return name
 
 
+def normalize_song_rows(rows, original_fields, standard_names):
+    """Add guess_song_name / play_format to rows in place.
+
+    Returns (new_fields, rows, changed_count).
+    """
+    # Construct new field order:
+    # - insert 'guess_song_name' after 'song_name'
+    # - insert 'play_format' after 'clear_lamp'
+    new_fields = []
+    # If fields already contain our new columns, keep original order
+    if "guess_song_name" in original_fields or "play_format" in original_fields:
+        new_fields = original_fields
+    else:
+        for f in original_fields:
+            new_fields.append(f)
+            if f == "song_name":
+                new_fields.append("guess_song_name")
+            if f == "clear_lamp":
+                new_fields.append("play_format")
+
+        # Safety fallback if expected insertions didn't occur
+        if "guess_song_name" not in new_fields:
+            new_fields.append("guess_song_name")
+        if "play_format" not in new_fields:
+            new_fields.append("play_format")
+
+    changed_count = 0
+    for row in rows:
+        original_song = row["song_name"]
+        normalized_song = get_best_match(original_song, standard_names)
+
+        if normalized_song != original_song:
+            changed_count += 1
+
+        row["guess_song_name"] = normalized_song
+        # Ensure play_format exists and is an empty string
+        row["play_format"] = ""
+
+    return new_fields, rows, changed_count
+
+
+def _normalize_song_chunk(fieldnames, rows, standard_names):
+    """Worker: normalize one chunk -> (new_fields, rows, changed, CSV text)."""
+    new_fields, rows, changed_count = normalize_song_rows(
+        rows, fieldnames, standard_names
+    )
+    return new_fields, len(rows), changed_count, csv_text(new_fields, rows)
+
+
 def process_songs(input_path, output_path, song_list_path):
     # song_list_path may be a JSON path; provide fallback txt constant
     standard_names = load_song_names(song_list_path, SONG_LIST_TXT_FALLBACK)
     print(f"Loaded {len(standard_names)} standard song names.")
 
     try:
-        with open(input_path, "r", encoding="utf-8") as infile:
-            reader = csv.DictReader(infile)
-            rows = list(reader)
-            original_fields = reader.fieldnames
-
-            # Construct new field order:
-            # - insert 'guess_song_name' after 'song_name'
-            # - insert 'play_format' after 'clear_lamp'
-            new_fields = []
-            # If fields already contain our new columns, keep original order
-            if "guess_song_name" in original_fields or "play_format" in original_fields:
-                new_fields = original_fields
-            else:
-                for f in original_fields:
-                    new_fields.append(f)
-                    if f == "song_name":
-                        new_fields.append("guess_song_name")
-                    if f == "clear_lamp":
-                        new_fields.append("play_format")
-
-                # Safety fallback if expected insertions didn't occur
-                if "guess_song_name" not in new_fields:
-                    new_fields.append("guess_song_name")
-                if "play_format" not in new_fields:
-                    new_fields.append("play_format")
-
-            changed_count = 0
-            for row in rows:
-                original_song = row["song_name"]
-                normalized_song = get_best_match(original_song, standard_names)
-
-                if normalized_song != original_song:
-                    changed_count += 1
-
-                row["guess_song_name"] = normalized_song
-                # Ensure play_format exists and is an empty string
-                row["play_format"] = ""
-
-            # Write output
-            os.makedirs(os.path.dirname(output_path), exist_ok=True)
-            with open(output_path, "w", encoding="utf-8", newline="") as outfile:
-                writer = csv.DictWriter(outfile, fieldnames=new_fields)
-                writer.writeheader()
-                writer.writerows(rows)
+        # Memory-mapped chunks are parsed, matched and rendered across cores
+        # (row order preserved)
+        chunks = map_csv_chunks(
+            resolve_input(input_path), _normalize_song_chunk, (standard_names,)
+        )
+        new_fields, row_count, changed_count, text = next(chunks)
+
+        # Write output (compressed when NOUSUJI_COMPRESSION is set)
+        output_path = compressed_path(output_path)
+        os.makedirs(os.path.dirname(output_path), exist_ok=True)
+        with open_text(output_path, "w", newline="") as outfile:
+            csv.writer(outfile).writerow(new_fields)
+            outfile.write(text)
+            for _, rows, changed, text in chunks:
+                outfile.write(text)
+                row_count += rows
+                changed_count += changed
 
         print(
-            f"Step 1 Complete. Processed {len(rows)} rows. Mapped {changed_count} songs."
+            f"Step 1 Complete. Processed {row_count} rows. Mapped {changed_count} songs."
         )
         print(f"Output saved to {output_path}")
 
@@ -0,0 +1,160 @@
+import csv
+import io
+import mmap
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+from csv_io import detect_compression, open_text
+
+# Files smaller than this are parsed in-process; spawning workers costs more
+# than it saves on the usual few-hundred-row dumps.
+PARALLEL_MIN_BYTES = 8 * 1024 * 1024
+# Target size of one worker chunk (aligned to record boundaries)
+CHUNK_BYTES = 4 * 1024 * 1024
+
+
+def _header_end(mm):
+    """Return the offset just past the header record (0 if file is empty)."""
+    return _next_record_start(mm, 0, 0, len(mm))[0]
+
+
+def _next_record_start(mm, pos, quotes, size):
+    """Advance from `pos` to the first record boundary at or after it.
+
+    `quotes` is the number of '"' bytes seen between the previous boundary and
+    `pos`. A newline only ends a record when the running quote count is even;
+    otherwise it sits inside a quoted field (e.g. multi-line Post_Content).
+    Escaped quotes ("") add two and keep the parity. UTF-8 continuation
+    bytes never collide with '"' or '\\n', so scanning raw bytes is safe.
+
+    Returns (boundary, quotes) where boundary is the offset after the newline.
+    """
+    while pos < size:
+        nl = mm.find(b"\n", pos)
+        if nl == -1:
+            return size, 0
+        quotes += mm[pos:nl].count(b'"')
+        pos = nl + 1
+        if quotes % 2 == 0:
+            return pos, 0
+    return size, 0
+
+
+def _split_chunks(mm, start, chunk_bytes):
+    """Split mm[start:] into record-aligned (start, end) byte ranges."""
+    size = len(mm)
+    chunks = []
+    while start < size:
+        target = min(start + chunk_bytes, size)
+        if target >= size:
+            chunks.append((start, size))
+            break
+        # Count quotes from the chunk start so the boundary search knows
+        # whether `target` falls inside a quoted field.
+        quotes = mm[start:target].count(b'"')
+        end, _ = _next_record_start(mm, target, quotes, size)
+        chunks.append((start, end))
+        start = end
+    return chunks
+
+
+def _parse_chunk(path, start, end, fieldnames):
+    """Worker: parse one record-aligned byte range into row dicts."""
+    with (
+        open(path, "rb") as f,
+        mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm,
+    ):
+        text = mm[start:end].decode("utf-8")
+    reader = csv.DictReader(io.StringIO(text, newline=""), fieldnames=fieldnames)
+    return list(reader)
+
+
+def _map_chunk(path, start, end, fieldnames, func, args):
+    """Worker: parse one chunk and apply func to its rows."""
+    return func(fieldnames, _parse_chunk(path, start, end, fieldnames), *args)
+
+
+def _chunk_rows(fieldnames, rows):
+    return fieldnames, rows
+
+
+def csv_text(fieldnames, rows):
+    """Render row dicts as CSV text (no header), as csv.DictWriter writes them."""
+    buf = io.StringIO(newline="")
+    csv.DictWriter(buf, fieldnames=fieldnames).writerows(rows)
+    return buf.getvalue()
+
+
+def map_csv_chunks(path, func, args=(), workers=None, chunk_bytes=CHUNK_BYTES):
+    """Apply func(fieldnames, rows, *args) to record-aligned chunks of a CSV.
+
+    The file is memory-mapped and split into chunks that are parsed and
+    passed to func inside worker processes, so per-row work runs across
+    cores and only func's result is sent back (keep it compact, e.g. CSV
+    text from csv_text). func must be a module-level function. Results
+    are yielded in file order; there is always at least one, with empty
+    rows for a header-only file and fieldnames None for an empty one.
+    Small files, a single worker, and compressed (gzip/zstd) files, which
+    cannot be mapped, are handled in-process as one chunk.
+    """
+    if detect_compression(path):
+        with open_text(path, "r", newline="") as f:
+            reader = csv.DictReader(f)
+            rows = list(reader)
+        yield func(reader.fieldnames, rows, *args)
+        return
+    if workers is None:
+        workers = os.cpu_count() or 1
+    rows = None
+    with open(path, "rb") as f:
+        size = os.fstat(f.fileno()).st_size
+        if size == 0:
+            fieldnames, rows = None, []
+        else:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                header_end = _header_end(mm)
+                header_text = mm[:header_end].decode("utf-8")
+                fieldnames = next(
+                    csv.reader(io.StringIO(header_text, newline="")), None
+                )
+                if fieldnames is None:
+                    rows = []
+                elif size < PARALLEL_MIN_BYTES or workers == 1:
+                    body = mm[header_end:].decode("utf-8")
+                    reader = csv.DictReader(
+                        io.StringIO(body, newline=""), fieldnames=fieldnames
+                    )
+                    rows = list(reader)
+                else:
+                    chunks = _split_chunks(mm, header_end, chunk_bytes)
+    if rows is not None:
+        yield func(fieldnames, rows, *args)
+        return
+    if not chunks:
+        yield func(fieldnames, [], *args)
+        return
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = [
+            pool.submit(_map_chunk, path, start, end, fieldnames, func, args)
+            for start, end in chunks
+        ]
+        # Yield in submission order to preserve original row order
+        for fut in futures:
+            yield fut.result()
+
+
+def read_csv_parallel(path, workers=None, chunk_bytes=CHUNK_BYTES):
+    """Read a CSV file into (fieldnames, rows) like csv.DictReader.
+
+    Chunks are parsed across processes (see map_csv_chunks), but every row
+    dict is unpickled in this process, which costs about as much as parsing
+    it. Stages that transform rows and write them out should do that work
+    in map_csv_chunks instead.
+    """
+    fieldnames, rows = None, []
+    for fieldnames, chunk_rows in map_csv_chunks(
+        path, _chunk_rows, workers=workers, chunk_bytes=chunk_bytes
+    ):
+        rows.extend(chunk_rows)
+    return fieldnames, rows
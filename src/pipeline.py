@@ -0,0 +1,108 @@
+import os
+
+from normalize_options import normalize_option_rows
+from normalize_songs import (
+    SONG_LIST_TXT_FALLBACK,
+    load_song_names,
+    normalize_song_rows,
+)
+from parallel_csv import read_csv_parallel
+from proc_GM_ranking import (
+    compute_grandmaster,
+    grandmaster_header,
+    history_header,
+    load_song_list,
+)
+from proc_music_ranking import HISTORY_COLUMNS, OUTPUT_COLUMNS, compute_rankings
+
+# In-process API over the normalization and ranking stages. Each function
+# takes rows (dicts, as csv.DictReader yields) and returns Table objects, so
+# callers such as marimotest.py can chain stages without writing files.
+
+PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+SONG_LIST_FILE = os.path.join(PROJECT_ROOT, "input", "song_list.json")
+
+
+class Table:
+    """Column names plus rows (dicts or lists in column order)."""
+
+    def __init__(self, columns, rows):
+        self.columns = list(columns)
+        self.rows = rows
+
+    def __len__(self):
+        return len(self.rows)
+
+    def __iter__(self):
+        return iter(self.rows)
+
+    def __repr__(self):
+        return f"Table({len(self.rows)} rows x {len(self.columns)} columns)"
+
+    def to_dataframe(self):
+        """Build a pandas DataFrame directly from the in-memory rows."""
+        import pandas as pd
+
+        if self.rows and isinstance(self.rows[0], dict):
+            return pd.DataFrame.from_records(self.rows, columns=self.columns)
+        return pd.DataFrame(self.rows, columns=self.columns)
+
+
+def read_rows(path):
+    """Read a CSV into (fieldnames, rows) with the parallel reader."""
+    fieldnames, rows = read_csv_parallel(path)
+    return fieldnames or [], rows
+
+
+def normalize(rows, fieldnames, song_list_path=SONG_LIST_FILE, diagnostics=None):
+    """Steps 1 + 2: guess_song_name, option split and clear_award.
+
+    Rows are updated in place and returned as a Table. Pass a
+    SanitizeDiagnostics to inspect sanitized Left/Right tokens.
+    """
+    standard_names = load_song_names(song_list_path, SONG_LIST_TXT_FALLBACK)
+    fields, rows, _ = normalize_song_rows(rows, fieldnames, standard_names)
+    fields, rows = normalize_option_rows(rows, fields, diagnostics)
+    return Table(fields, rows)
+
+
+def rankings(rows):
+    """Per-song rankings and histories: ({song: Table}, {song: Table})."""
+    ranked, histories = compute_rankings(rows)
+    return (
+        {song: Table(OUTPUT_COLUMNS, r) for song, r in ranked.items()},
+        {song: Table(HISTORY_COLUMNS, h) for song, h in histories.items()},
+    )
+
+
+def grandmaster(rows, song_list_path=SONG_LIST_FILE):
+    """GrandMaster table and per-tweet history as (Table, Table).
+
+    Rates and total_score are floats; history rates are None for songs not
+    in that tweet.
+    """
+    name_to_no, notes_by_no, song_nos = load_song_list(song_list_path)
+    gm_rows, hist_rows = compute_grandmaster(rows, name_to_no, notes_by_no, song_nos)
+    return (
+        Table(grandmaster_header(song_nos), gm_rows),
+        Table(history_header(song_nos), hist_rows),
+    )
+
+
+class PipelineResult:
+    def __init__(
+        self, normalized, rankings, histories, grandmaster, grandmaster_history
+    ):
+        self.normalized = normalized
+        self.rankings = rankings
+        self.histories = histories
+        self.grandmaster = grandmaster
+        self.grandmaster_history = grandmaster_history
+
+
+def run(rows, fieldnames, song_list_path=SONG_LIST_FILE):
+    """Run every stage in memory on raw result rows."""
+    normalized = normalize(rows, fieldnames, song_list_path)
+    ranked, histories = rankings(normalized.rows)
+    gm, gm_history = grandmaster(normalized.rows, song_list_path)
+    return PipelineResult(normalized, ranked, histories, gm, gm_history)
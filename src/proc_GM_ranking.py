@@ -2,6 +2,19 @@ import os
 import json
 import csv
 import datetime
+import itertools
+import operator
+import sys
+
+from csv_io import compressed_path, open_text
+from external_sort import ExternalSorter, SpillBudget, default_budget
+from proc_music_ranking import cell_text
+from result_manifest import (
+    GRANDMASTER_HISTORY_KIND,
+    GRANDMASTER_KIND,
+    record_run,
+)
+from shard_merge import expand_inputs, iter_merged_rows
 
 
 PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
@@ -34,125 +47,117 @@ def load_song_list(json_path):
     return name_to_no, notes_by_no, song_nos
 
 
-def build_grandmaster(input_csv, input_json, output_file):
-    os.makedirs(os.path.dirname(output_file), exist_ok=True)
+def parse_row(row, name_to_no):
+    """Extract the GM fields of one result row.
 
-    name_to_no, notes_by_no, song_nos = load_song_list(input_json)
+    Returns None for rows without a TwitterID or for songs outside the
+    selected list.
+    """
+    twitter_id = cell_text(row, "TwitterID")
+    if not twitter_id:
+        return None
+    guess_song = cell_text(row, "guess_song_name")
+    # Only consider songs that are in the selected list
+    if guess_song not in name_to_no:
+        return None
+    score_raw = cell_text(row, "score")
+    try:
+        score = int(score_raw) if score_raw.isdigit() else 0
+    except Exception:
+        score = 0
+    return {
+        "twitter_id": twitter_id,
+        "user_name": cell_text(row, "UserName"),
+        "guess_song": guess_song,
+        "song_no": name_to_no[guess_song],
+        "score": score,
+        "comment": cell_text(row, "Post_Content"),
+        # capture submission date/time for history (prefer latest)
+        "sub_date": cell_text(row, "submission_date"),
+        "sub_time": cell_text(row, "submission_time"),
+        "tweet_url": cell_text(row, "Tweet_URL"),
+    }
 
-    users = {}
-    # Collect history entries keyed by Tweet_URL (if present) or generated unique key
-    history_entries = {}
 
-    with open(input_csv, "r", encoding="utf-8") as f:
-        reader = csv.DictReader(f)
-        for row in reader:
-            twitter_id = row.get("TwitterID", "").strip()
-            if not twitter_id:
-                continue
-            user_name = row.get("UserName", "").strip()
-            guess_song = row.get("guess_song_name", "").strip()
-            score_raw = row.get("score", "").strip()
-            try:
-                score = int(score_raw) if score_raw.isdigit() else 0
-            except Exception:
-                score = 0
-            comment = row.get("Post_Content", "").strip()
-            # capture submission date/time for history (prefer latest)
-            sub_date = row.get("submission_date", "").strip()
-            sub_time = row.get("submission_time", "").strip()
-
-            # Only consider songs that are in the selected list
-            if guess_song not in name_to_no:
-                continue
-            song_no = name_to_no[guess_song]
-
-            if twitter_id not in users:
-                users[twitter_id] = {
-                    "UserName": user_name,
-                    "SNS": twitter_id,
-                    "scores": {},  # song_no -> best score
-                    "comments": [],
-                    "last_submission_date": sub_date,
-                    "last_submission_time": sub_time,
-                }
-            user = users[twitter_id]
-            # keep first seen UserName if empty later rows
-            if not user["UserName"] and user_name:
-                user["UserName"] = user_name
-
-            # update best score per song
-            prev = user["scores"].get(song_no, -1)
-            if score > prev:
-                user["scores"][song_no] = score
-
-            # collect comments (avoid exact duplicates)
-            if comment:
-                if comment not in user["comments"]:
-                    user["comments"].append(comment)
-
-            # update last submission date/time to the latest seen
-            if sub_date:
-                # compare tuple (date, time)
-                prev_date = user.get("last_submission_date", "")
-                prev_time = user.get("last_submission_time", "")
-                if (sub_date, sub_time) > (prev_date, prev_time):
-                    user["last_submission_date"] = sub_date
-                    user["last_submission_time"] = sub_time
-
-            # Build history entry per Tweet_URL; if Tweet_URL missing, create unique key
-            tweet_url = row.get("Tweet_URL", "").strip()
-            key = (
-                tweet_url
-                if tweet_url
-                else f"{twitter_id}|{sub_date}|{sub_time}|{len(history_entries)}"
-            )
-            if key not in history_entries:
-                history_entries[key] = {
-                    "submission_date": sub_date,
-                    "submission_time": sub_time,
-                    "UserName": user_name,
-                    "SNS": twitter_id,
-                    "comments": [],
-                    "rates": {},
-                }
-            hent = history_entries[key]
-            if comment and comment not in hent["comments"]:
-                hent["comments"].append(comment)
-            # compute rate for this song_no and store
-            if guess_song in name_to_no:
-                no = name_to_no[guess_song]
-                notes = notes_by_no.get(no, 0)
-                try:
-                    rate = score / (notes * 2) if notes else 0.0
-                except Exception:
-                    rate = 0.0
-                hent["rates"][no] = rate
+def update_user(users, rec):
+    """Merge one parsed row (see parse_row) into the per-user GM state."""
+    twitter_id = rec["twitter_id"]
+    user_name = rec["user_name"]
+    sub_date = rec["sub_date"]
+    sub_time = rec["sub_time"]
+    if twitter_id not in users:
+        users[twitter_id] = {
+            "UserName": user_name,
+            "SNS": twitter_id,
+            "scores": {},  # song_no -> best score
+            "comments": [],
+            "last_submission_date": sub_date,
+            "last_submission_time": sub_time,
+        }
+    user = users[twitter_id]
+    # keep first seen UserName if empty later rows
+    if not user["UserName"] and user_name:
+        user["UserName"] = user_name
+
+    # update best score per song
+    prev = user["scores"].get(rec["song_no"], -1)
+    if rec["score"] > prev:
+        user["scores"][rec["song_no"]] = rec["score"]
+
+    # collect comments (avoid exact duplicates)
+    comment = rec["comment"]
+    if comment:
+        if comment not in user["comments"]:
+            user["comments"].append(comment)
+
+    # update last submission date/time to the latest seen
+    if sub_date:
+        # compare tuple (date, time)
+        prev_date = user.get("last_submission_date", "")
+        prev_time = user.get("last_submission_time", "")
+        if (sub_date, sub_time) > (prev_date, prev_time):
+            user["last_submission_date"] = sub_date
+            user["last_submission_time"] = sub_time
+    return user
 
+
+def user_rates(user, song_nos, notes_by_no):
+    """Per-song rates (score / (notes * 2)) and their total for one user."""
+    total = 0.0
+    per_rates = []
+    for no in song_nos:
+        score = user["scores"].get(no)
+        notes = notes_by_no.get(no, 0)
+        if score is None or notes == 0:
+            rate = 0.0
+            per_rates.append(rate)
+        else:
+            rate = score / (notes * 2)
+            per_rates.append(rate)
+        total += rate
+    return per_rates, total
+
+
+def grandmaster_header(song_nos):
     # Prepare header (add total_score after song columns)
-    header = (
+    return (
         ["UserName"]
         + [f"song_no{no}" for no in song_nos]
         + ["total_score", "SNS", "Comment"]
     )
 
-    # Build rows with numeric total_score for sorting
+
+def grandmaster_rows(users, song_nos, notes_by_no):
+    """GM table rows sorted by total_score.
+
+    Values are kept typed: per-song rates and total_score are floats (0.0
+    for songs without a score); write_grandmaster formats them.
+    """
     rows = []
     for twitter_id, u in users.items():
         row_vals = [u.get("UserName", "")]
-        total = 0.0
-        per_rates = []
-        for no in song_nos:
-            score = u["scores"].get(no)
-            notes = notes_by_no.get(no, 0)
-            if score is None or notes == 0:
-                rate = 0.0
-                per_rates.append(rate)
-            else:
-                rate = score / (notes * 2)
-                per_rates.append(rate)
-            total += rate
-        # row_vals will contain formatted rate strings (4 decimal places)
-        row_vals += [f"{r:.4f}" if r != 0.0 else "" for r in per_rates]
+        per_rates, total = user_rates(u, song_nos, notes_by_no)
+        row_vals += per_rates
         row_vals.append(total)
         row_vals.append(u.get("SNS", ""))
         comment_text = " | ".join(u["comments"]) if u["comments"] else ""
@@ -162,58 +167,220 @@ def build_grandmaster(input_csv, input_json, output_file):
     # Sort by total_score (index after UserName and song columns)
     total_idx = 1 + len(song_nos)
     rows.sort(key=lambda r: r[total_idx], reverse=True)
+    return rows
 
-    # Write output CSV, formatting total_score to 4 decimals
-    with open(output_file, "w", encoding="utf-8", newline="") as out:
+
+def write_grandmaster(output_file, song_nos, rows):
+    # Write output CSV, formatting rates and total_score to 4 decimals
+    total_idx = 1 + len(song_nos)
+    with open_text(output_file, "w", newline="") as out:
         writer = csv.writer(out)
-        writer.writerow(header)
+        writer.writerow(grandmaster_header(song_nos))
         for r in rows:
-            # format total_score to 4 decimals string
             formatted = list(r)
+            # rate strings (4 decimal places), blank for songs without a score
+            for i in range(1, total_idx):
+                formatted[i] = f"{r[i]:.4f}" if r[i] != 0.0 else ""
             formatted[total_idx] = f"{formatted[total_idx]:.4f}"
             writer.writerow(formatted)
 
-    print(f"Created {output_file} with {len(users)} records.")
 
-    # Also write a history file per tweet (do not collapse same user; merge rows with same Tweet_URL)
-    history_file = os.path.join(RESULT_DIR, f"GrandMaster_history_{timestamp}.csv")
-    history_header = (
+def history_header(song_nos):
+    return (
         ["submission_date", "submission_time", "UserName"]
         + [f"song_no{no}" for no in song_nos]
         + ["total_score", "SNS", "Comment"]
     )
+
+
+def history_row(hent, song_nos):
+    """One history entry -> typed row (rates are None for songs not in the tweet)."""
+    row_vals = [
+        hent.get("submission_date", ""),
+        hent.get("submission_time", ""),
+        hent.get("UserName", ""),
+    ]
+    total = 0.0
+    per_rates = []
+    for no in song_nos:
+        rate = hent["rates"].get(no)
+        per_rates.append(rate)
+        if rate is not None:
+            total += rate
+    row_vals += per_rates
+    row_vals.append(total)
+    row_vals.append(hent.get("SNS", ""))
+    comment_text = " | ".join(hent["comments"]) if hent.get("comments") else ""
+    row_vals.append(comment_text)
+    return row_vals
+
+
+def history_sort_key(r):
+    return (r[0], r[1])
+
+
+def history_rows(history_entries, song_nos):
+    """One row per tweet sorted by submission_date then submission_time.
+
+    Per-song rates are floats, or None for songs not in the tweet.
+    """
     # Sort history entries by submission_date then submission_time
     sorted_entries = sorted(
         history_entries.values(),
         key=lambda e: (e.get("submission_date", ""), e.get("submission_time", "")),
     )
-    with open(history_file, "w", encoding="utf-8", newline="") as hf:
+    return [history_row(hent, song_nos) for hent in sorted_entries]
+
+
+def format_history_row(r):
+    """Typed history row -> CSV values (rates and total to 4 decimals)."""
+    formatted = list(r)
+    for i in range(3, len(r) - 2):
+        formatted[i] = "" if r[i] is None else f"{r[i]:.4f}"
+    return formatted
+
+
+def history_key(rec, seq):
+    """History entry key of a row: its Tweet_URL, or the row itself if none."""
+    return (rec["tweet_url"], 0) if rec["tweet_url"] else ("", seq)
+
+
+def new_history_entry(rec):
+    return {
+        "submission_date": rec["sub_date"],
+        "submission_time": rec["sub_time"],
+        "UserName": rec["user_name"],
+        "SNS": rec["twitter_id"],
+        "comments": [],
+        "rates": {},
+    }
+
+
+def add_to_history_entry(hent, rec, notes_by_no):
+    comment = rec["comment"]
+    if comment and comment not in hent["comments"]:
+        hent["comments"].append(comment)
+    # compute rate for this song_no and store
+    no = rec["song_no"]
+    notes = notes_by_no.get(no, 0)
+    try:
+        rate = rec["score"] / (notes * 2) if notes else 0.0
+    except Exception:
+        rate = 0.0
+    hent["rates"][no] = rate
+
+
+def spilled_history_rows(by_tweet, song_nos, notes_by_no, memory_budget):
+    """History rows from an ExternalSorter of (key, seq, rec) by tweet.
+
+    Rows of one tweet are adjacent in by_tweet, so each entry is built and
+    released in turn. Entries are put back in first-seen order and then
+    sorted by submission time, which gives the same (stable) order as
+    history_rows. Returns the final ExternalSorter.
+    """
+    by_first_seen = ExternalSorter(operator.itemgetter(0), memory_budget)
+    for _, group in itertools.groupby(by_tweet, key=operator.itemgetter(0)):
+        hent = None
+        for _, seq, rec in group:
+            if hent is None:
+                first_seq, hent = seq, new_history_entry(rec)
+            add_to_history_entry(hent, rec, notes_by_no)
+        by_first_seen.append((first_seq, history_row(hent, song_nos)))
+    by_tweet.close()
+
+    sorter = ExternalSorter(history_sort_key, memory_budget)
+    for _, row in by_first_seen:
+        sorter.append(row)
+    by_first_seen.close()
+    return sorter
+
+
+def compute_grandmaster(rows, name_to_no, notes_by_no, song_nos, memory_budget=None):
+    """Aggregate result rows into (GM table rows, GM history rows).
+
+    History entries merge the rows of one Tweet_URL. With a memory_budget
+    the rows are grouped by tweet through an ExternalSorter instead of a
+    dict (see spilled_history_rows) and the history comes back as an
+    ExternalSorter; close() it after use.
+    """
+    users = {}
+    # Collect history entries keyed by Tweet_URL (if present) or by row
+    history_entries = {}
+    by_tweet = None
+    if memory_budget is not None:
+        # One budget for all the history sorts
+        if isinstance(memory_budget, int):
+            memory_budget = SpillBudget(memory_budget)
+        by_tweet = ExternalSorter(operator.itemgetter(0, 1), memory_budget)
+
+    for seq, row in enumerate(rows):
+        rec = parse_row(row, name_to_no)
+        if rec is None:
+            continue
+        update_user(users, rec)
+
+        key = history_key(rec, seq)
+        if by_tweet is not None:
+            by_tweet.append((key, seq, rec))
+            continue
+        if key not in history_entries:
+            history_entries[key] = new_history_entry(rec)
+        add_to_history_entry(history_entries[key], rec, notes_by_no)
+
+    gm_rows = grandmaster_rows(users, song_nos, notes_by_no)
+    if by_tweet is None:
+        return gm_rows, history_rows(history_entries, song_nos)
+    return gm_rows, spilled_history_rows(by_tweet, song_nos, notes_by_no, memory_budget)
+
+
+def build_grandmaster(input_csv, input_json, output_file, memory_budget=None):
+    os.makedirs(os.path.dirname(output_file), exist_ok=True)
+
+    name_to_no, notes_by_no, song_nos = load_song_list(input_json)
+
+    # input_csv may be a path, glob or list of shards merged by submission time
+    paths = expand_inputs(input_csv)
+    if not paths:
+        raise FileNotFoundError(f"No input found for {input_csv}")
+    # Bounded-memory history sort when NOUSUJI_SORT_MEMORY_MB is set
+    if memory_budget is None:
+        memory_budget = default_budget()
+    rows, hist_rows = compute_grandmaster(
+        iter_merged_rows(paths), name_to_no, notes_by_no, song_nos, memory_budget
+    )
+
+    # Compressed when NOUSUJI_COMPRESSION is set
+    output_file = compressed_path(output_file)
+    write_grandmaster(output_file, song_nos, rows)
+    print(f"Created {output_file} with {len(rows)} records.")
+
+    # Also write a history file per tweet (do not collapse same user; merge rows with same Tweet_URL)
+    history_file = compressed_path(
+        os.path.join(RESULT_DIR, f"GrandMaster_history_{timestamp}.csv")
+    )
+    with open_text(history_file, "w", newline="") as hf:
         hwriter = csv.writer(hf)
-        hwriter.writerow(history_header)
-        for hent in sorted_entries:
-            row_vals = [
-                hent.get("submission_date", ""),
-                hent.get("submission_time", ""),
-                hent.get("UserName", ""),
-            ]
-            total = 0.0
-            per_rates = []
-            for no in song_nos:
-                rate = hent["rates"].get(no)
-                if rate is None:
-                    per_rates.append("")
-                else:
-                    per_rates.append(f"{rate:.4f}")
-                    total += rate
-            row_vals += per_rates
-            row_vals.append(f"{total:.4f}")
-            row_vals.append(hent.get("SNS", ""))
-            comment_text = " | ".join(hent["comments"]) if hent.get("comments") else ""
-            row_vals.append(comment_text)
-            hwriter.writerow(row_vals)
-
-    print(f"Created {history_file} with {len(sorted_entries)} records.")
+        hwriter.writerow(history_header(song_nos))
+        for r in hist_rows:
+            hwriter.writerow(format_history_row(r))
+
+    print(f"Created {history_file} with {len(hist_rows)} records.")
+
+    # Index this run's files and move the GrandMaster latest pointers
+    record_run(
+        "grandmaster",
+        f"grandmaster_{timestamp}",
+        [
+            (GRANDMASTER_KIND, output_file, len(rows)),
+            (GRANDMASTER_HISTORY_KIND, history_file, len(hist_rows)),
+        ],
+        paths + [input_json],
+        RESULT_DIR,
+    )
+    if memory_budget is not None:
+        hist_rows.close()
 
 
 if __name__ == "__main__":
-    build_grandmaster(INPUT_CSV, INPUT_JSON, OUTPUT_FILE)
+    # Optional CLI args: input paths or glob patterns (shards)
+    build_grandmaster(sys.argv[1:] or INPUT_CSV, INPUT_JSON, OUTPUT_FILE)
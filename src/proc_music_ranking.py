@@ -2,6 +2,13 @@ import csv
 import collections
 import os
 import datetime
+import itertools
+import sys
+
+from csv_io import compressed_path, open_text, resolve_input
+from external_sort import ExternalSorter, SpillBudget, default_budget
+from result_manifest import history_kind, ranking_kind, record_run
+from shard_merge import expand_inputs, read_fieldnames, iter_merged_rows
 
 # Columns for history output (fixed order)
 HISTORY_COLUMNS = [
@@ -41,58 +48,101 @@ def get_rank(lamp):
     return LAMP_RANKS.get(lamp, 0)
 
 
-def process_ranking(input_file, manual_file=None):
-    # Dictionary structure:
-    # { guess_song_name: { twitter_id: { record_data } } }
-    songs_data = collections.defaultdict(dict)
-    # For history output: list of rows per song (preserve full row dict)
-    songs_history = collections.defaultdict(list)
+def cell_text(row, key):
+    """Stripped string value of a row cell.
 
-    # Read main processed CSV
-    all_rows = []
-    fieldnames = []
-    if os.path.exists(input_file):
-        with open(input_file, "r", encoding="utf-8") as f:
-            reader = csv.DictReader(f)
-            fieldnames = reader.fieldnames or []
-            all_rows.extend(list(reader))
+    Rows from csv are all strings, but rows from a DataFrame (e.g. the
+    notebook's int-typed score) may carry ints or None.
+    """
+    value = row.get(key, "")
+    return "" if value is None else str(value).strip()
 
-    # Read manual users file if provided or exists
+
+# Columns for best-record (ranking) output
+OUTPUT_COLUMNS = [
+    "UserName",
+    "TwitterID",
+    "score",
+    "Left",
+    "Right",
+    "FLIP",
+    "LEGACY",
+    "A-SCR",
+    "play_format",
+    "clear_award",
+]
+
+
+def manual_users_path(manual_file=None):
+    """Resolve manual_users.csv (default: input/manual_users.csv); None if absent."""
     if manual_file is None:
         manual_file = os.path.join(
             os.path.dirname(os.path.dirname(__file__)), "input", "manual_users.csv"
         )
-    if os.path.exists(manual_file):
-        with open(manual_file, "r", encoding="utf-8") as mf:
-            mreader = csv.DictReader(mf)
-            mfields = mreader.fieldnames or []
-            # extend fieldnames to include any extra manual columns while preserving order
-            for f in mfields:
-                if f not in fieldnames:
-                    fieldnames.append(f)
-            for mrow in mreader:
-                # Ensure keys exist for expected columns
-                all_rows.append(mrow)
+    manual_file = resolve_input(manual_file)
+    return manual_file if os.path.exists(manual_file) else None
 
-    # Process rows
-    for row in all_rows:
-        song = row.get("guess_song_name", "").strip()
-        twitter_id = row.get("TwitterID", "").strip()
 
-        # Skip invalid rows
-        if not song or not twitter_id:
-            continue
+def load_row_sources(input_file, manual_file=None):
+    """Open the processed CSV shards and manual_users.csv separately.
 
-        # Append to history using fixed HISTORY_COLUMNS order; normalize missing keys to ''
-        normalized_row = {k: row.get(k, "") for k in HISTORY_COLUMNS}
-        songs_history[song].append(normalized_row)
+    Returns (fieldnames, shard_rows, manual_rows); both row sources are
+    lazy iterators over the shared fieldnames. input_file may be a path, a
+    glob pattern or a list of them; shards are merged by submission time
+    (see shard_merge). manual_rows is empty when there is no manual file.
+    """
+    paths = expand_inputs(input_file)
+    fieldnames = read_fieldnames(paths)
+
+    # Read manual users file if provided or exists
+    manual_file = manual_users_path(manual_file)
+    if manual_file is not None:
+        # extend fieldnames to include any extra manual columns while preserving order
+        for f in read_fieldnames([manual_file]):
+            if f not in fieldnames:
+                fieldnames.append(f)
+
+    def iter_manual_rows():
+        if manual_file is not None:
+            with open_text(manual_file, "r") as mf:
+                yield from csv.DictReader(mf)
+
+    return fieldnames, iter_merged_rows(paths, fieldnames), iter_manual_rows()
+
+
+def load_rows(input_file, manual_file=None):
+    """Open the processed CSV shards plus manual_users.csv as (fieldnames, rows).
+
+    rows is an iterator (see load_row_sources), so the shard union is never
+    materialized. Manual rows follow the shards.
+    """
+    fieldnames, shard_rows, manual_rows = load_row_sources(input_file, manual_file)
+    return fieldnames, itertools.chain(shard_rows, manual_rows)
+
+
+def update_best_record(songs_data, row):
+    """Merge one result row into songs_data.
 
-        score_raw = str(row.get("score", "")).strip()
-        new_score = int(score_raw) if score_raw.isdigit() else 0
-        new_award = row.get("clear_award", "")
+    songs_data is { guess_song_name: { twitter_id: { record_data } } }.
+    A higher score replaces the play options; the clear_award is kept at the
+    best lamp seen. Returns (song, twitter_id), or None for rows without a
+    song or TwitterID.
+    """
+    song = cell_text(row, "guess_song_name")
+    twitter_id = cell_text(row, "TwitterID")
 
+    # Skip invalid rows
+    if not song or not twitter_id:
+        return None
+
+    score_raw = cell_text(row, "score")
+    new_score = int(score_raw) if score_raw.isdigit() else 0
+    new_award = row.get("clear_award", "")
+
+    users = songs_data.setdefault(song, {})
+    if twitter_id not in users:
         # Columns to track for best-record output
-        data = {
+        users[twitter_id] = {
             "UserName": row.get("UserName", ""),
             "TwitterID": twitter_id,
             "score": new_score,
@@ -104,35 +154,95 @@ def process_ranking(input_file, manual_file=None):
             "play_format": row.get("play_format", ""),
             "clear_award": new_award,
         }
+    else:
+        current_record = users[twitter_id]
+        if new_score > current_record["score"]:
+            current_record["score"] = new_score
+            current_record["Left"] = row.get("Left", "")
+            current_record["Right"] = row.get("Right", "")
+            current_record["FLIP"] = row.get("FLIP", "")
+            current_record["LEGACY"] = row.get("LEGACY", "")
+            current_record["A-SCR"] = row.get("A-SCR", "")
+            current_record["play_format"] = row.get("play_format", "")
+            current_record["UserName"] = row.get("UserName", "")
+        if get_rank(new_award) > get_rank(current_record.get("clear_award", "")):
+            current_record["clear_award"] = new_award
+    return song, twitter_id
+
+
+def sort_ranking(users):
+    """Best records of one song sorted by score descending."""
+    return sorted(users.values(), key=lambda x: x["score"], reverse=True)
+
+
+def safe_song_name(song_name):
+    # Sanitize filename just in case
+    return song_name.replace("/", "_")  # Basic safety
+
+
+def write_ranking(filepath, sorted_users):
+    with open_text(filepath, "w", newline="") as outfile:
+        writer = csv.DictWriter(outfile, fieldnames=OUTPUT_COLUMNS)
+        writer.writeheader()
+        writer.writerows(sorted_users)
 
-        if twitter_id not in songs_data[song]:
-            songs_data[song][twitter_id] = data
-        else:
-            current_record = songs_data[song][twitter_id]
-            if new_score > current_record["score"]:
-                current_record["score"] = new_score
-                current_record["Left"] = row.get("Left", "")
-                current_record["Right"] = row.get("Right", "")
-                current_record["FLIP"] = row.get("FLIP", "")
-                current_record["LEGACY"] = row.get("LEGACY", "")
-                current_record["A-SCR"] = row.get("A-SCR", "")
-                current_record["play_format"] = row.get("play_format", "")
-                current_record["UserName"] = row.get("UserName", "")
-            if get_rank(new_award) > get_rank(current_record.get("clear_award", "")):
-                current_record["clear_award"] = new_award
-    # Output files
-    output_columns = [
-        "UserName",
-        "TwitterID",
-        "score",
-        "Left",
-        "Right",
-        "FLIP",
-        "LEGACY",
-        "A-SCR",
-        "play_format",
-        "clear_award",
-    ]
+
+def hist_sort_key(r):
+    return (r.get("submission_date", ""), r.get("submission_time", ""))
+
+
+def compute_rankings(rows, memory_budget=None):
+    """Aggregate result rows into per-song rankings and histories.
+
+    Returns (rankings, histories): rankings maps song -> best records sorted
+    by score descending; histories maps song -> HISTORY_COLUMNS rows sorted
+    by submission_date + submission_time. With a memory_budget (bytes or a
+    SpillBudget) history values are ExternalSorter iterables that spill to
+    temp files; close() them after use.
+    """
+    # Dictionary structure:
+    # { guess_song_name: { twitter_id: { record_data } } }
+    songs_data = {}
+    # For history output: list of rows per song (preserve full row dict)
+    if memory_budget is None:
+        songs_history = collections.defaultdict(list)
+    else:
+        # One budget shared by every song's sorter, not one per song
+        if isinstance(memory_budget, int):
+            memory_budget = SpillBudget(memory_budget)
+        songs_history = collections.defaultdict(
+            lambda: ExternalSorter(hist_sort_key, memory_budget)
+        )
+
+    # Process rows
+    for row in rows:
+        key = update_best_record(songs_data, row)
+        if key is None:
+            continue
+
+        # Append to history using fixed HISTORY_COLUMNS order; normalize missing keys to ''
+        normalized_row = {k: row.get(k, "") for k in HISTORY_COLUMNS}
+        songs_history[key[0]].append(normalized_row)
+
+    rankings = {song: sort_ranking(users) for song, users in songs_data.items()}
+    if memory_budget is None:
+        histories = {
+            song: sorted(rows_hist, key=hist_sort_key)
+            for song, rows_hist in songs_history.items()
+        }
+    else:
+        histories = dict(songs_history)
+    return rankings, histories
+
+
+def process_ranking(input_file, manual_file=None, memory_budget=None):
+    # Bounded-memory history sort when NOUSUJI_SORT_MEMORY_MB is set
+    if memory_budget is None:
+        memory_budget = default_budget()
+
+    # Stream main processed CSV shards and manual users file
+    _, all_rows = load_rows(input_file, manual_file)
+    rankings, histories = compute_rankings(all_rows, memory_budget)
 
     # Determine project root and ensure Result directory exists
     project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
@@ -141,42 +251,46 @@ def process_ranking(input_file, manual_file=None):
 
     # Timestamp for this run (same timestamp for all files in one execution)
     timestamp = datetime.datetime.now().strftime("%Y%m%d%H%M%S")
+    # (kind, path, rows) for the run manifest
+    outputs = []
 
-    for song_name, users in songs_data.items():
-        # Sanitize filename just in case
-        safe_name = song_name.replace("/", "_")  # Basic safety
+    for song_name, sorted_users in rankings.items():
+        safe_name = safe_song_name(song_name)
         filename = f"{safe_name}_{timestamp}.csv"
-        filepath = os.path.join(result_dir, filename)
-
-        # Sort by score descending
-        sorted_users = sorted(users.values(), key=lambda x: x["score"], reverse=True)
+        # Compressed when NOUSUJI_COMPRESSION is set
+        filepath = compressed_path(os.path.join(result_dir, filename))
 
-        with open(filepath, "w", encoding="utf-8", newline="") as outfile:
-            writer = csv.DictWriter(outfile, fieldnames=output_columns)
-            writer.writeheader()
-            writer.writerows(sorted_users)
+        write_ranking(filepath, sorted_users)
 
         print(f"Created {filepath} with {len(sorted_users)} records.")
+        outputs.append((ranking_kind(song_name), filepath, len(sorted_users)))
 
         # Also create history file for this song
         history_filename = f"{safe_name}_history_{timestamp}.csv"
-        history_path = os.path.join(result_dir, history_filename)
+        history_path = compressed_path(os.path.join(result_dir, history_filename))
         # If we have recorded history rows, write them sorted by date+time
-        rows_hist = songs_history.get(song_name, [])
-        if rows_hist:
-            # Use fixed HISTORY_COLUMNS as header and sort by submission_date + submission_time
-            hist_header = HISTORY_COLUMNS
-
-            def hist_sort_key(r):
-                return (r.get("submission_date", ""), r.get("submission_time", ""))
-
-            rows_hist_sorted = sorted(rows_hist, key=hist_sort_key)
-            with open(history_path, "w", encoding="utf-8", newline="") as hout:
-                hwriter = csv.DictWriter(hout, fieldnames=hist_header)
+        rows_hist_sorted = histories.get(song_name, [])
+        if rows_hist_sorted:
+            # Use fixed HISTORY_COLUMNS as header
+            with open_text(history_path, "w", newline="") as hout:
+                hwriter = csv.DictWriter(hout, fieldnames=HISTORY_COLUMNS)
                 hwriter.writeheader()
                 hwriter.writerows(rows_hist_sorted)
             print(f"Created {history_path} with {len(rows_hist_sorted)} records.")
+            outputs.append(
+                (history_kind(song_name), history_path, len(rows_hist_sorted))
+            )
+        if memory_budget is not None and song_name in histories:
+            histories[song_name].close()
+
+    # Index this run's files and move the per-song latest pointers
+    inputs = expand_inputs(input_file)
+    manual_path = manual_users_path(manual_file)
+    if manual_path is not None:
+        inputs.append(manual_path)
+    record_run("ranking", f"ranking_{timestamp}", outputs, inputs, result_dir)
 
 
 if __name__ == "__main__":
-    process_ranking(INPUT_FILE)
+    # Optional CLI args: input paths or glob patterns (shards)
+    process_ranking(sys.argv[1:] or INPUT_FILE)
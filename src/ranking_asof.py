@@ -0,0 +1,294 @@
+import bisect
+import json
+import os
+import pickle
+import shutil
+import sys
+
+from proc_music_ranking import (
+    INPUT_FILE,
+    PROJECT_ROOT,
+    load_row_sources,
+    manual_users_path,
+    update_best_record,
+    sort_ranking,
+    safe_song_name,
+    write_ranking,
+)
+from proc_GM_ranking import (
+    INPUT_JSON,
+    RESULT_DIR,
+    load_song_list,
+    parse_row,
+    update_user,
+    grandmaster_rows,
+    write_grandmaster,
+)
+from csv_io import compressed_path
+from external_sort import ExternalSorter, default_budget
+from result_manifest import file_sha256
+from shard_merge import expand_inputs, time_key
+
+# Take a snapshot of the aggregated state every N rows (in time order).
+# A query replays at most N - 1 rows on top of the nearest checkpoint.
+CHECKPOINT_EVERY = 500
+# Every K-th checkpoint stores the full state; the ones in between store
+# only the records changed since the previous checkpoint.
+KEYFRAME_EVERY = 16
+# Checkpoints persist here between runs and are reused while inputs match
+CHECKPOINT_DIR = os.path.join(PROJECT_ROOT, "output", "asof_checkpoints")
+INDEX_FILE = "index.json"
+INDEX_VERSION = 2
+
+
+def inputs_signature(paths, input_json, checkpoint_every, keyframe_every):
+    """Identify a checkpoint set by input file hashes and checkpoint spacing."""
+    return {
+        "version": INDEX_VERSION,
+        "checkpoint_every": checkpoint_every,
+        "keyframe_every": keyframe_every,
+        "inputs": {os.path.abspath(p): file_sha256(p) for p in paths},
+        "song_list": file_sha256(input_json),
+    }
+
+
+class RankingTimeline:
+    """Point-in-time view over the best-record state, backed by disk.
+
+    Rows are ordered by (submission_date, submission_time) (stable, so rows
+    with the same timestamp keep their input order). Segment i holds rows
+    [i * N, (i + 1) * N), each flagged as a shard or manual_users.csv row,
+    plus the state at its start: every KEYFRAME_EVERY-th segment pickles the
+    full per-song best records and GM user state, the others only the
+    records changed during the previous segment. A query loads the nearest
+    keyframe, applies the deltas up to the segment covering the requested
+    time and replays at most N rows of it. Rows without a timestamp sort
+    first and are part of every query.
+    """
+
+    def __init__(self, store_dir=CHECKPOINT_DIR, input_json=INPUT_JSON):
+        self.store_dir = store_dir
+        self.name_to_no, self.notes_by_no, self.song_nos = load_song_list(input_json)
+        with open(os.path.join(store_dir, INDEX_FILE), "r", encoding="utf-8") as f:
+            self.index = json.load(f)
+        # First row key of each segment, for bisecting a query time
+        self.first_keys = [tuple(k) for k in self.index["first_keys"]]
+
+    @classmethod
+    def build(
+        cls,
+        rows,
+        store_dir=CHECKPOINT_DIR,
+        input_json=INPUT_JSON,
+        checkpoint_every=CHECKPOINT_EVERY,
+        signature=None,
+        memory_budget=None,
+        manual_rows=(),
+        keyframe_every=KEYFRAME_EVERY,
+    ):
+        """Sort rows by time and write the checkpoint segments to store_dir.
+
+        rows are result shard rows; manual_rows (manual_users.csv) only
+        count for the song rankings, as in proc_GM_ranking. The sort goes
+        through ExternalSorter (bounded by memory_budget or
+        NOUSUJI_SORT_MEMORY_MB); only the running state and one segment of
+        rows are held in memory while writing.
+        """
+        checkpoint_every = max(1, checkpoint_every)
+        keyframe_every = max(1, keyframe_every)
+        if memory_budget is None:
+            memory_budget = default_budget()
+        name_to_no, _, _ = load_song_list(input_json)
+
+        sorter = ExternalSorter(lambda item: time_key(item[0]), memory_budget)
+        for row in rows:
+            sorter.append((row, False))
+        for row in manual_rows:
+            sorter.append((row, True))
+
+        shutil.rmtree(store_dir, ignore_errors=True)
+        os.makedirs(store_dir)
+        songs_data = {}
+        users = {}
+        first_keys = []
+        segment = []
+        # Keys touched since the last checkpoint, in first-touch order
+        changed_songs = {}
+        changed_users = {}
+        state_at_start = pickle.dumps(
+            ("full", songs_data, users), pickle.HIGHEST_PROTOCOL
+        )
+
+        def flush():
+            path = os.path.join(store_dir, f"segment{len(first_keys):06d}.pkl")
+            with open(path, "wb") as f:
+                f.write(state_at_start)
+                pickle.dump(segment, f, protocol=pickle.HIGHEST_PROTOCOL)
+            first_keys.append(time_key(segment[0][0]))
+
+        for row, manual in sorter:
+            segment.append((row, manual))
+            song_key, user_key = apply_row(songs_data, users, row, name_to_no, manual)
+            if song_key is not None:
+                changed_songs[song_key] = None
+            if user_key is not None:
+                changed_users[user_key] = None
+            if len(segment) == checkpoint_every:
+                flush()
+                segment = []
+                if len(first_keys) % keyframe_every == 0:
+                    state = ("full", songs_data, users)
+                else:
+                    state = (
+                        "delta",
+                        [(s, t, songs_data[s][t]) for s, t in changed_songs],
+                        [(t, users[t]) for t in changed_users],
+                    )
+                state_at_start = pickle.dumps(state, pickle.HIGHEST_PROTOCOL)
+                changed_songs.clear()
+                changed_users.clear()
+        if segment:
+            flush()
+        sorter.close()
+
+        index = dict(signature or {})
+        index.update(
+            {
+                "checkpoint_every": checkpoint_every,
+                "keyframe_every": keyframe_every,
+                "rows": len(sorter),
+                "first_keys": first_keys,
+            }
+        )
+        with open(os.path.join(store_dir, INDEX_FILE), "w", encoding="utf-8") as f:
+            json.dump(index, f, ensure_ascii=False)
+        return cls(store_dir, input_json)
+
+    @classmethod
+    def for_inputs(
+        cls,
+        input_file=INPUT_FILE,
+        manual_file=None,
+        store_dir=CHECKPOINT_DIR,
+        input_json=INPUT_JSON,
+        checkpoint_every=CHECKPOINT_EVERY,
+        keyframe_every=KEYFRAME_EVERY,
+    ):
+        """Open stored checkpoints, rebuilding only when the inputs changed."""
+        paths = expand_inputs(input_file)
+        manual_path = manual_users_path(manual_file)
+        if manual_path is not None:
+            paths.append(manual_path)
+        signature = inputs_signature(
+            paths, input_json, checkpoint_every, keyframe_every
+        )
+        index_path = os.path.join(store_dir, INDEX_FILE)
+        if os.path.exists(index_path):
+            with open(index_path, "r", encoding="utf-8") as f:
+                stored = json.load(f)
+            if all(stored.get(k) == v for k, v in signature.items()):
+                return cls(store_dir, input_json)
+        print(f"Building as-of checkpoints in {store_dir}")
+        _, shard_rows, manual_rows = load_row_sources(input_file, manual_file)
+        return cls.build(
+            shard_rows,
+            store_dir,
+            input_json,
+            checkpoint_every,
+            signature=signature,
+            manual_rows=manual_rows,
+            keyframe_every=keyframe_every,
+        )
+
+    def segment_path(self, i):
+        return os.path.join(self.store_dir, f"segment{i:06d}.pkl")
+
+    def load_segment(self, i):
+        """(songs_data, users, rows) for segment i, rows as (row, manual)."""
+        keyframe = i - i % self.index["keyframe_every"]
+        with open(self.segment_path(keyframe), "rb") as f:
+            _, songs_data, users = pickle.load(f)
+        for j in range(keyframe + 1, i + 1):
+            with open(self.segment_path(j), "rb") as f:
+                _, changed_songs, changed_users = pickle.load(f)
+            for song, twitter_id, record in changed_songs:
+                songs_data.setdefault(song, {})[twitter_id] = record
+            for twitter_id, user in changed_users:
+                users[twitter_id] = user
+        with open(self.segment_path(i), "rb") as f:
+            pickle.load(f)
+            rows = pickle.load(f)
+        return songs_data, users, rows
+
+    def state_as_of(self, date, time="999999"):
+        """(songs_data, users) after every row at or before (date, time)."""
+        if not self.first_keys:
+            return {}, {}
+        query = (date, time)
+        # Last segment starting at or before the query (segment 0 otherwise)
+        i = max(0, bisect.bisect_right(self.first_keys, query) - 1)
+        songs_data, users, rows = self.load_segment(i)
+        for row, manual in rows:
+            if time_key(row) > query:
+                break
+            apply_row(songs_data, users, row, self.name_to_no, manual)
+        return songs_data, users
+
+    def rankings_as_of(self, date, time="999999"):
+        """{ song: best records sorted by score } as of (date, time)."""
+        songs_data, _ = self.state_as_of(date, time)
+        return {song: sort_ranking(users) for song, users in songs_data.items()}
+
+    def grandmaster_as_of(self, date, time="999999"):
+        """GM table rows (numeric total_score) as of (date, time)."""
+        _, users = self.state_as_of(date, time)
+        return grandmaster_rows(users, self.song_nos, self.notes_by_no)
+
+    def write_as_of(self, date, time="999999", result_dir=RESULT_DIR):
+        """Write per-song and GrandMaster ranking files as of (date, time)."""
+        os.makedirs(result_dir, exist_ok=True)
+        songs_data, users = self.state_as_of(date, time)
+        stamp = f"{date}{time}"
+        for song_name, song_users in songs_data.items():
+            filepath = compressed_path(
+                os.path.join(
+                    result_dir, f"{safe_song_name(song_name)}_asof_{stamp}.csv"
+                )
+            )
+            sorted_users = sort_ranking(song_users)
+            write_ranking(filepath, sorted_users)
+            print(f"Created {filepath} with {len(sorted_users)} records.")
+        gm_file = compressed_path(
+            os.path.join(result_dir, f"GrandMaster_asof_{stamp}.csv")
+        )
+        rows = grandmaster_rows(users, self.song_nos, self.notes_by_no)
+        write_grandmaster(gm_file, self.song_nos, rows)
+        print(f"Created {gm_file} with {len(rows)} records.")
+
+
+def apply_row(songs_data, users, row, name_to_no, manual=False):
+    """Apply one row to the best-record and GM state.
+
+    Manual rows (manual_users.csv) only update the song rankings; the GM
+    table is built from the result shards alone. Returns the keys touched:
+    ((song, twitter_id) or None, GM twitter_id or None).
+    """
+    song_key = update_best_record(songs_data, row)
+    if manual:
+        return song_key, None
+    rec = parse_row(row, name_to_no)
+    if rec is None:
+        return song_key, None
+    update_user(users, rec)
+    return song_key, rec["twitter_id"]
+
+
+if __name__ == "__main__":
+    # Usage: python ranking_asof.py YYYYMMDD [HHMMSS]
+    if len(sys.argv) < 2:
+        print("Usage: python ranking_asof.py YYYYMMDD [HHMMSS]")
+        sys.exit(1)
+    as_of_date = sys.argv[1]
+    as_of_time = sys.argv[2] if len(sys.argv) > 2 else "999999"
+    timeline = RankingTimeline.for_inputs()
+    timeline.write_as_of(as_of_date, as_of_time)
@@ -0,0 +1,128 @@
+import datetime
+import hashlib
+import json
+import os
+
+# Index of runs -> output files, kept in Result/.
+#   manifest.json: every retained run with its outputs, row counts and
+#                  input hashes
+#   latest.json:   output kind -> newest file, so finding the current
+#                  ranking is one small read instead of a directory scan
+PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+RESULT_DIR = os.path.join(PROJECT_ROOT, "Result")
+MANIFEST_FILE = "manifest.json"
+LATEST_FILE = "latest.json"
+
+# Runs kept per source script; older runs and their files are pruned.
+# 0 (default) keeps everything.
+KEEP_RUNS = int(os.environ.get("NOUSUJI_KEEP_RUNS", "0") or 0)
+
+
+def ranking_kind(song_name):
+    return f"ranking:{song_name}"
+
+
+def history_kind(song_name):
+    return f"history:{song_name}"
+
+
+GRANDMASTER_KIND = "grandmaster"
+GRANDMASTER_HISTORY_KIND = "grandmaster_history"
+
+
+def file_sha256(path):
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+def _load_json(path, default):
+    if not os.path.exists(path):
+        return default
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return default
+
+
+def _write_json(path, data):
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False, indent=2)
+    os.replace(tmp_path, path)
+
+
+def load_manifest(result_dir=RESULT_DIR):
+    return _load_json(os.path.join(result_dir, MANIFEST_FILE), {"runs": []})
+
+
+def load_latest(result_dir=RESULT_DIR):
+    return _load_json(os.path.join(result_dir, LATEST_FILE), {})
+
+
+def latest_output(kind, result_dir=RESULT_DIR):
+    """Absolute path of the newest file for `kind`, or None."""
+    entry = load_latest(result_dir).get(kind)
+    if entry is None:
+        return None
+    return os.path.join(result_dir, entry["path"])
+
+
+def record_run(source, run_id, outputs, inputs, result_dir=RESULT_DIR, keep_runs=None):
+    """Add a run to the manifest, move latest pointers and apply retention.
+
+    outputs is a list of (kind, path, row_count); inputs a list of input
+    file paths, stored with their sha256. Returns the manifest entry.
+    """
+    keep_runs = KEEP_RUNS if keep_runs is None else keep_runs
+    manifest = load_manifest(result_dir)
+    latest = load_latest(result_dir)
+
+    run = {
+        "run_id": run_id,
+        "source": source,
+        "created": datetime.datetime.now().isoformat(timespec="seconds"),
+        "inputs": {os.path.abspath(p): file_sha256(p) for p in inputs},
+        "outputs": [
+            {"kind": kind, "path": os.path.relpath(path, result_dir), "rows": rows}
+            for kind, path, rows in outputs
+        ],
+    }
+    manifest["runs"].append(run)
+    for out in run["outputs"]:
+        latest[out["kind"]] = {
+            "path": out["path"],
+            "run_id": run_id,
+            "rows": out["rows"],
+        }
+
+    if keep_runs > 0:
+        prune_runs(manifest, latest, source, keep_runs, result_dir)
+
+    _write_json(os.path.join(result_dir, MANIFEST_FILE), manifest)
+    _write_json(os.path.join(result_dir, LATEST_FILE), latest)
+    return run
+
+
+def prune_runs(manifest, latest, source, keep_runs, result_dir=RESULT_DIR):
+    """Drop all but the newest `keep_runs` runs of `source` and their files.
+
+    Files still referenced by a latest pointer are kept.
+    """
+    same_source = [r for r in manifest["runs"] if r["source"] == source]
+    expired = same_source[: max(0, len(same_source) - keep_runs)]
+    if not expired:
+        return
+    live_paths = {entry["path"] for entry in latest.values()}
+    for run in expired:
+        for out in run["outputs"]:
+            if out["path"] in live_paths:
+                continue
+            path = os.path.join(result_dir, out["path"])
+            if os.path.exists(path):
+                os.remove(path)
+    expired_ids = {id(r) for r in expired}
+    manifest["runs"] = [r for r in manifest["runs"] if id(r) not in expired_ids]
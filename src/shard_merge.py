@@ -0,0 +1,103 @@
+import contextlib
+import csv
+import glob
+import heapq
+import os
+
+from csv_io import open_text, resolve_input
+
+GLOB_CHARS = ("*", "?", "[")
+
+
+def time_key(row):
+    return (
+        row.get("submission_date", "").strip(),
+        row.get("submission_time", "").strip(),
+    )
+
+
+def expand_inputs(spec):
+    """Resolve a path, glob pattern or list of them to existing shard files.
+
+    Glob matches are sorted by name so the shard order (which decides ties
+    on equal timestamps) is stable between runs. A plain path falls back to
+    its .gz/.zst sibling; missing paths are skipped, like a missing
+    INPUT_FILE is today.
+    """
+    if isinstance(spec, (str, os.PathLike)):
+        spec = [spec]
+    paths = []
+    for item in spec:
+        item = os.fspath(item)
+        if any(ch in item for ch in GLOB_CHARS):
+            matches = sorted(glob.glob(item))
+        else:
+            item = resolve_input(item)
+            matches = [item] if os.path.exists(item) else []
+        for p in matches:
+            if p not in paths:
+                paths.append(p)
+    return paths
+
+
+def read_fieldnames(paths):
+    """Union of shard headers, in first-seen order (as for manual_users.csv)."""
+    fieldnames = []
+    for path in paths:
+        with open_text(path, "r") as f:
+            for name in next(csv.reader(f), []):
+                if name not in fieldnames:
+                    fieldnames.append(name)
+    return fieldnames
+
+
+def _shard_rows(reader, fieldnames):
+    if reader.fieldnames == fieldnames:
+        yield from reader
+        return
+    # Reconcile schema: columns missing from this shard become ''
+    for row in reader:
+        yield {f: row.get(f, "") for f in fieldnames}
+
+
+class ShardOrderError(ValueError):
+    """A shard is not sorted by (submission_date, submission_time)."""
+
+
+def _checked_order(rows, path):
+    """Pass rows through, raising ShardOrderError if a timestamp goes back."""
+    prev = None
+    for record_no, row in enumerate(rows, start=1):
+        key = time_key(row)
+        if prev is not None and key < prev:
+            raise ShardOrderError(
+                f"{path}: record {record_no} ({key[0]} {key[1]}) is earlier than the "
+                f"previous record ({prev[0]} {prev[1]}); shards must be sorted by "
+                "submission_date, submission_time to be merged"
+            )
+        prev = key
+        yield row
+
+
+def iter_merged_rows(paths, fieldnames=None):
+    """Lazily merge time-sorted shards by (submission_date, submission_time).
+
+    Each shard is read row by row and combined with a k-way heap merge, so
+    only one pending row per shard is held in memory. Rows with equal
+    timestamps come out in shard order. A single shard is passed through in
+    file order. With several shards each one must be time-sorted, otherwise
+    the merge order would silently be wrong; ShardOrderError is raised at
+    the first out-of-order row.
+    """
+    if fieldnames is None:
+        fieldnames = read_fieldnames(paths)
+    with contextlib.ExitStack() as stack:
+        streams = []
+        for path in paths:
+            f = stack.enter_context(open_text(path, "r"))
+            streams.append(_shard_rows(csv.DictReader(f), fieldnames))
+        if len(streams) == 1:
+            yield from streams[0]
+            return
+        streams = [_checked_order(s, p) for s, p in zip(streams, paths)]
+        yield from heapq.merge(*streams, key=time_key)
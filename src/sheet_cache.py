@@ -0,0 +1,156 @@
+import json
+import os
+import re
+
+# Default location for local sheet snapshots
+PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+CACHE_DIR = os.path.join(PROJECT_ROOT, "output", "sheet_cache")
+
+# Columns coerced to int like the notebook does (non-numeric -> 0)
+INT_COLUMNS = ["best_score", "score"]
+
+SNAPSHOT_VERSION = 2
+
+
+def to_int(value):
+    """Coerce a sheet cell to int; blanks and non-numeric values become 0."""
+    if isinstance(value, int):
+        return value
+    try:
+        return int(float(str(value).strip()))
+    except (TypeError, ValueError):
+        return 0
+
+
+def column_letter(col):
+    """1-based column index -> A1 column letters (1 -> A, 27 -> AA)."""
+    letters = ""
+    while col > 0:
+        col, rem = divmod(col - 1, 26)
+        letters = chr(ord("A") + rem) + letters
+    return letters
+
+
+class SheetSnapshotCache:
+    """Read-through cache of a worksheet stored as a typed local snapshot.
+
+    The snapshot keeps the header, the typed data rows and the raw last row.
+    `get_rows()` makes one batch read of the header row and of everything
+    from the last cached row on: if both still match the snapshot, the rows
+    after it are the only new data (none means a cache hit); otherwise the
+    whole sheet is reloaded. The check is scoped to this worksheet, so
+    sheets added or rewritten elsewhere in the spreadsheet do not invalidate
+    it. Edits to rows other than the header and the last cached row are not
+    detected, so pass full=True after manual corrections.
+    """
+
+    def __init__(self, worksheet, cache_dir=CACHE_DIR, int_columns=None):
+        self.worksheet = worksheet
+        self.int_columns = INT_COLUMNS if int_columns is None else int_columns
+        safe_title = re.sub(r"[^\w.-]", "_", worksheet.title)
+        self.path = os.path.join(cache_dir, f"{safe_title}.json")
+        self.last_fetch = None  # "hit", "append" or "full" after get_rows()
+
+    def load_snapshot(self):
+        if not os.path.exists(self.path):
+            return None
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                snap = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if snap.get("version") != SNAPSHOT_VERSION:
+            return None
+        return snap
+
+    def save_snapshot(self, snap):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(snap, f, ensure_ascii=False)
+        os.replace(tmp_path, self.path)
+
+    def type_rows(self, header, rows):
+        """Pad rows to the header width and coerce int columns."""
+        int_idx = [i for i, h in enumerate(header) if h in self.int_columns]
+        typed = []
+        for r in rows:
+            r = self.pad(header, r)
+            for i in int_idx:
+                r[i] = to_int(r[i])
+            typed.append(r)
+        return typed
+
+    def pad(self, header, row):
+        width = len(header)
+        return list(row[:width]) + [""] * (width - len(row))
+
+    def fetch_full(self):
+        values = self.worksheet.get_values()
+        # gspread returns [[]] for an empty sheet
+        values = [r for r in values if r] if len(values) == 1 else values
+        header = values[0] if values else []
+        rows = self.type_rows(header, values[1:]) if values else []
+        self.last_fetch = "full"
+        return {
+            "version": SNAPSHOT_VERSION,
+            "header": header,
+            "rows": rows,
+            # Raw (untyped) last row, used to verify the cache is a prefix
+            "last_raw": self.pad(header, values[-1]) if len(values) > 1 else [],
+        }
+
+    def fetch_appended(self, snap):
+        """Snapshot plus rows appended after it; None if it is not a prefix."""
+        header = snap["header"]
+        n_cached = len(snap["rows"])
+        if not header:
+            return None
+        # Sheet row numbers are 1-based and row 1 is the header, so the tail
+        # range starts at the last cached row (or the header if none)
+        head, tail = self.worksheet.batch_get(
+            ["1:1", f"A{n_cached + 1}:{column_letter(len(header))}"]
+        )
+        # Trailing blank cells are not returned, so compare padded rows
+        live_header = list(head[0]) if head else []
+        if self.pad(header, live_header) != header or any(live_header[len(header) :]):
+            return None
+        # Empty ranges come back as [] or [[]]; drop trailing blank rows
+        tail = list(tail)
+        while tail and not any(str(v).strip() for v in tail[-1]):
+            tail.pop()
+        expected = snap.get("last_raw") if n_cached else header
+        if not tail or self.pad(header, tail[0]) != expected:
+            return None
+        new_values = tail[1:]
+        if not new_values:
+            self.last_fetch = "hit"
+            return snap
+        self.last_fetch = "append"
+        return {
+            "version": SNAPSHOT_VERSION,
+            "header": header,
+            "rows": snap["rows"] + self.type_rows(header, new_values),
+            "last_raw": self.pad(header, new_values[-1]),
+        }
+
+    def get_rows(self, full=False):
+        """Return (header, typed rows), fetching only what changed."""
+        snap = None if full else self.load_snapshot()
+        new_snap = None
+        if snap is not None:
+            new_snap = self.fetch_appended(snap)
+        if new_snap is None:
+            new_snap = self.fetch_full()
+        if self.last_fetch != "hit":
+            self.save_snapshot(new_snap)
+        return new_snap["header"], new_snap["rows"]
+
+    def get_dataframe(self, full=False):
+        """Return the typed snapshot as a pandas DataFrame."""
+        import pandas as pd
+
+        header, rows = self.get_rows(full=full)
+        if not header:
+            return pd.DataFrame()
+        return pd.DataFrame(rows, columns=header)